@@ -5,7 +5,7 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AmbiDream.settings')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sleepyapp.settings')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
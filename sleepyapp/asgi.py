@@ -9,6 +9,6 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AmbiDream.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sleepyapp.settings')
 
 application = get_asgi_application()
\ No newline at end of file
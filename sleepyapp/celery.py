@@ -6,15 +6,16 @@ import os
 from celery import Celery
 
 # Set the default Django settings module for the 'celery' program.
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ambidream.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sleepyapp.settings')
 
 app = Celery('AmbiDream')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
-app.autodiscover_tasks()
+# Only tracker ships tasks; don't import every installed app's tasks module
+app.autodiscover_tasks(['tracker'])
 
 @app.task(bind=True, ignore_result=True)
 
-def debug task(self):
-    print(f'Request: {self, request!r}')
\ No newline at end of file
+def debug_task(self):
+    print(f'Request: {self.request!r}')
\ No newline at end of file
@@ -9,6 +9,6 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
-os.environ.setdefault("DJANGO_SETTINGS MODULE', 'AmbiDream.settings")
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sleepyapp.settings')
 
 application = get_wsgi_application()
\ No newline at end of file
@@ -2,22 +2,53 @@
 Admin configuration for Sleep Tracker
 """
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from .models import UserProfile, SleepSession, SleepGoal, SleepReminder, SleepStatistics
 
+
+class ApproxCountPaginator(Paginator):
+    """
+    Paginator that uses PostgreSQL's row estimate instead of COUNT(*)
+    for large, unfiltered changelists
+    """
+    # Below this many rows an exact count is cheap enough
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.exact_count_threshold:
+                return row[0]
+        return super().count
+
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'target_sleep_hours', 'notification_enabled', 'google_calendar_enabled']
     list_filter = ['notification_enabled', 'google_calendar_enabled']
-    search_fields = ['user_username', 'user_email']
-    readonly_fields = ['created at', 'updated_at']
+    list_select_related = ['user']
+    search_fields = ['user__username', 'user__email']
+    readonly_fields = ['created_at', 'updated_at']
 
 @admin.register(SleepSession)
 class SleepSessionAdmin(admin.ModelAdmin):
-    list_display = ['user', 'sleep_time', 'wake time', 'duration_hours', 'quality_rating', 'synced_to_calendar']
+    list_display = ['user', 'sleep_time', 'wake_time', 'duration_hours', 'quality_rating', 'synced_to_calendar']
     list_filter = ['quality_rating', 'synced_to_calendar', 'sleep_time']
-    search_fields = ['user_username', 'notes']
+    list_select_related = ['user']
+    search_fields = ['user__username', 'notes']
     readonly_fields = ['duration_hours', 'created_at', 'updated_at']
-    date_hierarchy = 'sleep time'
+    date_hierarchy = 'sleep_time'
+    paginator = ApproxCountPaginator
+    show_full_result_count = False
 
     fieldsets = (
         ('User', {
@@ -42,20 +73,23 @@ class SleepSessionAdmin(admin.ModelAdmin):
 class SleepGoalAdmin(admin.ModelAdmin):
     list_display= ['user', 'target_bedtime', 'target_wake_time', 'target_duration_hours', 'is_active']
     list_filter = ['is_active']
-    search_fields = ['user_username']
+    list_select_related = ['user']
+    search_fields = ['user__username']
     readonly_fields = ['created_at', 'updated_at']
 
 @admin.register(SleepReminder)
 class SleepReminderAdmin(admin.ModelAdmin): 
-    list_display = ['user', 'reminder type', 'reminder_time', 'is_active', 'last sent']
+    list_display = ['user', 'reminder_type', 'reminder_time', 'is_active', 'last_sent']
     list_filter = ['reminder_type', 'is_active']
-    search_fields = ['user_username']
-    readonly_fields = ['last sent, created at', 'updated at']
+    list_select_related = ['user']
+    search_fields = ['user__username']
+    readonly_fields = ['last_sent', 'created_at', 'updated_at']
 
 @admin.register(SleepStatistics)
 class SleepStatisticsAdmin(admin.ModelAdmin):
     list_display = ['user', 'date', 'period_type', 'average_sleep_hours', 'average_quality', 'sessions_count']
     list_filter = ['period_type', 'date']
-    search_fields = ['user_username']
+    list_select_related = ['user']
+    search_fields = ['user__username']
     readonly_fields = ['created_at', 'updated_at']
     date_hierarchy = 'date'
\ No newline at end of file
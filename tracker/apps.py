@@ -3,7 +3,7 @@ from django.apps import AppConfig
 
 class AmbidreamConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'AmbiDream'
+    name = 'tracker'
 
     def ready(self):
         """Import signals when app is ready"""
@@ -0,0 +1,175 @@
+"""
+Cache helpers for Sleep Tracker
+"""
+import logging
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from functools import lru_cache
+from .models import SleepReminder
+
+logger = logging.getLogger(__name__)
+
+# Statistics only change when the stats tasks run, so an hour is safe
+STATISTICS_CACHE_TIMEOUT = 60 * 60
+
+# The 30-day summary is computed from live sessions, so keep it short
+SUMMARY_CACHE_TIMEOUT = 5 * 60
+
+
+def _statistics_version_key(user_id):
+    return f'stats_version:{user_id}'
+
+
+def statistics_cache_key(user_id, path):
+    """
+    Build the cache key for a user's statistics response
+    Args:
+        user_id: ID of the requesting user
+        path: Full request path, including the query string
+    Returns:
+        Cache key string
+    """
+    version = cache.get_or_set(_statistics_version_key(user_id), 1, None)
+    return f'stats:{user_id}:{version}:{path}'
+
+
+def invalidate_statistics(user_id):
+    """
+    Invalidate every cached statistics response for a user
+    Args:
+        user_id: ID of the user whose statistics changed
+    """
+    try:
+        cache.incr(_statistics_version_key(user_id))
+    except ValueError:
+        # No version yet means nothing has been cached for this user
+        pass
+
+
+def summary_cache_key(user_id):
+    """
+    Build the cache key for a user's 30-day summary, scoped to today
+    Args:
+        user_id: ID of the requesting user
+    Returns:
+        Cache key string
+    """
+    return f'sleep_summary:{user_id}:{timezone.now().date()}'
+
+
+def invalidate_summary(user_id):
+    """
+    Drop a user's cached 30-day summary
+    Args:
+        user_id: ID of the user whose sessions changed
+    """
+    cache.delete(summary_cache_key(user_id))
+
+
+# Every reminder set keeps this member so it is never empty; a missing set
+# therefore means it was flushed or evicted, and that set gets rebuilt
+_REMINDER_SET_PLACEHOLDER = 0
+
+
+@lru_cache(maxsize=None)
+def _redis():
+    return redis.Redis.from_url(settings.REMINDER_INDEX_REDIS_URL)
+
+
+def reminder_index_key(reminder_type, minute_of_day):
+    return f'reminders:{reminder_type}:{minute_of_day}'
+
+
+def update_reminder_index(reminder):
+    """
+    Move a reminder into the set for its current type and minute
+    Args:
+        reminder: Saved SleepReminder
+    """
+    schedule = (reminder.reminder_type, reminder.reminder_minute_of_day)
+    key = reminder_index_key(*schedule)
+    loaded = getattr(reminder, '_loaded_schedule', None)
+
+    try:
+        with _redis().pipeline() as pipe:
+            if loaded and loaded != schedule:
+                pipe.srem(reminder_index_key(*loaded), reminder.pk)
+            if reminder.is_active:
+                pipe.sadd(key, _REMINDER_SET_PLACEHOLDER, reminder.pk)
+            else:
+                pipe.srem(key, reminder.pk)
+            pipe.execute()
+    except redis.RedisError:
+        # send_reminder_batch re-checks the schedule, and a rebuild repairs the sets
+        logger.exception("Could not update reminder index for reminder %s", reminder.pk)
+        return
+
+    reminder._loaded_schedule = schedule
+
+
+def remove_from_reminder_index(reminder_id, schedules):
+    """
+    Drop a deleted reminder from the reminder sets
+    Args:
+        reminder_id: ID the reminder had before it was deleted
+        schedules: (reminder_type, minute_of_day) pairs it may be indexed under
+    """
+    try:
+        with _redis().pipeline() as pipe:
+            for schedule in schedules:
+                pipe.srem(reminder_index_key(*schedule), reminder_id)
+            pipe.execute()
+    except redis.RedisError:
+        logger.exception("Could not remove reminder %s from the reminder index", reminder_id)
+
+
+def rebuild_reminder_set(reminder_type, minute_of_day):
+    """
+    Refill one missing reminder set from the database
+    Args:
+        reminder_type: 'bedtime', 'wake' or 'log'
+        minute_of_day: Minutes past midnight
+    """
+    reminder_ids = SleepReminder.objects.filter(
+        reminder_minute_of_day=minute_of_day,
+        reminder_type=reminder_type,
+        is_active=True
+    ).values_list('id', flat=True)
+
+    # SADD only: a reminder indexed after the query above must not be wiped,
+    # and one dropped meanwhile is filtered out again by send_reminder_batch
+    _redis().sadd(
+        reminder_index_key(reminder_type, minute_of_day),
+        _REMINDER_SET_PLACEHOLDER, *reminder_ids
+    )
+
+
+def due_reminder_ids(reminder_type, minute_of_day):
+    """
+    IDs of the active reminders of a type set for a minute of the day
+    Args:
+        reminder_type: 'bedtime', 'wake' or 'log'
+        minute_of_day: Minutes past midnight
+    Returns:
+        List of SleepReminder IDs
+    """
+    key = reminder_index_key(reminder_type, minute_of_day)
+    try:
+        members = _redis().smembers(key)
+        if not members:
+            rebuild_reminder_set(reminder_type, minute_of_day)
+            members = _redis().smembers(key)
+    except redis.RedisError:
+        logger.exception("Reminder index unavailable, reading due reminders from the database")
+        return list(SleepReminder.objects.filter(
+            reminder_minute_of_day=minute_of_day,
+            reminder_type=reminder_type,
+            is_active=True
+        ).values_list('id', flat=True))
+
+    return [
+        int(reminder_id) for reminder_id in members
+        if int(reminder_id) != _REMINDER_SET_PLACEHOLDER
+    ]
@@ -1,15 +1,74 @@
 """
 Google Calendar API Integration
 """
+import json
 import os
-import pickle
-from datetime import datetime, timedelta
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from functools import cached_property, lru_cache
+import httplib2
+from cachetools import LRUCache
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build 
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
 from django.conf import settings
+from django.core.cache import cache
+from .models import SleepSession, UserProfile
+
+
+# Built Calendar API resources, keyed by (UserProfile pk, hash of the stored
+# token) so re-authenticating or refreshing misses the cache. Building a
+# resource parses the discovery document, so reuse it for the same token.
+_SERVICE_CACHE = LRUCache(maxsize=256)
+_SERVICE_CACHE_LOCK = threading.Lock()
+
+# httplib2.Http isn't safe for concurrent use; each thread (or greenlet,
+# under gevent) sends requests through its own
+_local = threading.local()
+
+
+def _build_request(http, *args, **kwargs):
+    """
+    requestBuilder for cached resources: run each request on the calling
+    thread's own Http, authorized with the resource's credentials
+    """
+    if not hasattr(_local, 'http'):
+        _local.http = httplib2.Http()
+    return HttpRequest(AuthorizedHttp(http.credentials, http=_local.http), *args, **kwargs)
+
+# Google caps a batch request at 50 calls
+BATCH_SIZE = 50
+
+# Fields shared by every sleep event
+_EVENT_DEFAULTS = {
+    'colorId': '9',
+    'transparency': 'transparent',  # Don't show as busy
+}
+
+# Upper bound for keeping valid credentials in the Django cache (seconds)
+CREDENTIALS_CACHE_TIMEOUT = 3000
+# How long a worker may hold the refresh lock for a user (seconds)
+CREDENTIALS_REFRESH_LOCK_TIMEOUT = 30
+# How long other workers wait for that refresh, and how often they check (seconds)
+CREDENTIALS_REFRESH_WAIT = 5
+CREDENTIALS_REFRESH_POLL_INTERVAL = 0.25
+
+
+@lru_cache(maxsize=256)
+def _load_credentials(token_json):
+    """
+    Parse stored authorized-user JSON into a Credentials object
+    Args:
+     token_json: Output of Credentials.to_json()
+    Returns:
+     Credentials object
+    """
+    return Credentials.from_authorized_user_info(json.loads(token_json), settings.GOOGLE_CALENDAR_SCOPES)
 
 
 class GoogleCalendarService:
@@ -26,6 +85,30 @@ class GoogleCalendarService:
         """
         self.user_profile = user_profile
         self.service = None
+        self.timezone_name = user_profile.timezone if user_profile else 'UTC'
+
+    def _credentials_cache_key(self):
+        """
+        Cache key for this user's credentials
+        """
+        return f'gcal_creds:{self.user_profile.pk}'
+
+    def _cache_credentials(self, creds):
+        """
+        Keep valid credentials in the cache until shortly before they expire
+        Args:
+         creds: Valid Credentials object
+        """
+        if not self.user_profile:
+            return
+
+        timeout = CREDENTIALS_CACHE_TIMEOUT
+        if creds.expiry:
+            #google-auth keeps expiry as a naive UTC datetime
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            timeout = min(timeout, int((creds.expiry - now).total_seconds()))
+        if timeout > 0:
+            cache.set(self._credentials_cache_key(), creds.to_json(), timeout)
 
     def get_credentials(self):
         """
@@ -35,32 +118,85 @@ class GoogleCalendarService:
         """
         creds = None
 
+        #Serve recently validated credentials from the cache
+        if self.user_profile:
+            cached_token = cache.get(self._credentials_cache_key())
+            if cached_token:
+                creds = _load_credentials(cached_token)
+                if creds.valid:
+                    return creds
+                creds = None
+
         #Load from user profile if available 
         if self.user_profile and self.user_profile.google_refresh_token:
             try:
-                creds = pickle.loads(self.user_profile.google_refresh_token.encode('latin1'))
+                creds = _load_credentials(self.user_profile.google_refresh_token)
             except Exception as e:
                 print(f"Error loading credentials: {e}")
 
         #Check if credentials are valid 
         if creds and creds.valid:
+            self._cache_credentials(creds)
             return creds
 
         #Refresh if expired
         if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-                #Save refreshed credentials 
-                if self.user_profile:
-                    self.user_profile.google_refresh_token = pickle.dumps(creds).decode('latin1')
-                    self.user_profile.save()
-                return creds
-            except Exception as e:
-                print(f"Error refreshing credentials: {e}")
+            return self._refresh_credentials(creds)
 
         #Otherwise, need to re-authenticate 
         return None
 
+    def _wait_for_refreshed_credentials(self):
+        """
+        Wait for the worker holding the refresh lock to cache new credentials
+        Returns:
+         Valid Credentials object, or None if none appeared in time
+        """
+        deadline = time.monotonic() + CREDENTIALS_REFRESH_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(CREDENTIALS_REFRESH_POLL_INTERVAL)
+            cached_token = cache.get(self._credentials_cache_key())
+            if cached_token:
+                creds = _load_credentials(cached_token)
+                if creds.valid:
+                    return creds
+        return None
+
+    def _refresh_credentials(self, creds):
+        """
+        Refresh expired credentials, letting one worker per user call Google
+        Args:
+         creds: Expired Credentials object with a refresh token
+        Returns:
+         Refreshed Credentials object or None
+        """
+        lock_key = None
+        if self.user_profile:
+            lock_key = f'{self._credentials_cache_key()}:refreshing'
+            if not cache.add(lock_key, True, CREDENTIALS_REFRESH_LOCK_TIMEOUT):
+                refreshed = self._wait_for_refreshed_credentials()
+                if refreshed:
+                    return refreshed
+                #The lock holder didn't finish in time; refresh without it
+                lock_key = None
+
+        #_load_credentials shares its objects, so refresh a copy
+        creds = Credentials.from_authorized_user_info(json.loads(creds.to_json()), self.SCOPES)
+        try:
+            creds.refresh(Request())
+            if self.user_profile:
+                token = creds.to_json()
+                UserProfile.objects.filter(pk=self.user_profile.pk).update(google_refresh_token=token)
+                self.user_profile.google_refresh_token = token
+                self._cache_credentials(creds)
+            return creds
+        except Exception as e:
+            print(f"Error refreshing credentials: {e}")
+            return None
+        finally:
+            if lock_key:
+                cache.delete(lock_key)
+
     def authenticate(self):
         """
         Authenticate with Google Calendar API
@@ -80,32 +216,107 @@ class GoogleCalendarService:
 
         #Save credentials to user profile
         if self.user_profile:
-            self.user_profile.google_refresh_token = pickle.dumps(creds).decode('latin1')
+            self.user_profile.google_refresh_token = creds.to_json()
             self.user_profile.google_calendar_enabled = True
-            self.user_profile.save()
+            UserProfile.objects.filter(pk=self.user_profile.pk).update(
+                google_refresh_token=self.user_profile.google_refresh_token,
+                google_calendar_enabled=True
+            )
+            #Drop the cached token; the new token already misses _SERVICE_CACHE
+            cache.delete(self._credentials_cache_key())
 
+        self.service = None
+        self.__dict__.pop('events', None)
         return creds
 
-    def get_service(self):
+    def _service_cache_key(self):
+        """
+        _SERVICE_CACHE key for this user's current token, or None
+        """
+        if self.user_profile and self.user_profile.google_refresh_token:
+            return (self.user_profile.pk, hash(self.user_profile.google_refresh_token))
+        return None
+
+    def get_service(self, interactive=True):
         """
         Get or create Google Calendar service instance
+        Args:
+         interactive: Run the browser OAuth flow when there are no usable credentials
         Returns:
-         Google Calendar service object
+         Google Calendar service object, or None
         """
         if self.service:
             return self.service
 
+        cache_key = self._service_cache_key()
+        if cache_key is not None:
+            with _SERVICE_CACHE_LOCK:
+                service = _SERVICE_CACHE.get(cache_key)
+                #Once its token expires, AuthorizedHttp would refresh the cached
+                #resource's credentials in place, skipping the refresh lock and
+                #write-back; rebuild it from get_credentials instead
+                if service is not None and not service._http.credentials.valid:
+                    _SERVICE_CACHE.pop(cache_key, None)
+                    service = None
+            if service is not None:
+                self.service = service
+                return self.service
+
         creds = self.get_credentials()
         if not creds:
+            if not interactive:
+                return None
             creds = self.authenticate()
 
         try:
-            self.service = build('calendar', 'v3', credentials=creds)
+            #Use the discovery document bundled with googleapiclient instead of fetching it
+            self.service = build(
+                'calendar', 'v3',
+                credentials=creds,
+                requestBuilder=_build_request,
+                cache_discovery=False,
+                static_discovery=True
+            )
+            #Key on the token now stored, which get_credentials may have refreshed
+            cache_key = self._service_cache_key()
+            if cache_key is not None:
+                with _SERVICE_CACHE_LOCK:
+                    _SERVICE_CACHE[cache_key] = self.service
             return self.service
         except HttpError as error:
             print(f"An error occurred: {error}")
             return None
 
+    @cached_property
+    def events(self):
+        """
+        Events collection of the Calendar service, built once per instance
+        """
+        return self.get_service().events()
+
+    def _build_event(self, sleep_session):
+        """
+        Build the Calendar event body for a sleep session
+        Args:
+         sleep_session: SleepSession model instance
+        Returns:
+         Event resource dict
+        """
+        return {
+            **_EVENT_DEFAULTS,
+            'summary': f"Sleep ({sleep_session.duration_hours}h)",
+            'description': f"Sleep Quality: {sleep_session.get_quality_rating_display() if getattr(sleep_session, 'quality_rating', None) else 'Not rated'}\n"
+                           f"Notes: {sleep_session.notes}",
+            'start': {
+                'dateTime': sleep_session.sleep_time.isoformat(),
+                'timeZone': self.timezone_name,
+            },
+            'end': {
+                'dateTime': sleep_session.wake_time.isoformat(),
+                'timeZone': self.timezone_name,
+            },
+        }
+
     def create_sleep_event(self, sleep_session):
         """
         Create a sleep event in Google Calendar
@@ -120,23 +331,8 @@ class GoogleCalendarService:
             return None
 
         try:
-            event = {
-                'summary': f"Sleep ({sleep_session.duration_hours}h)",
-                'description': f"Sleep Quality: {sleep_session.get_quality_rating_display() if getattr(sleep_session, 'quality_rating', None) else 'Not rated'}\n"
-                               f"Notes: {sleep_session.notes}",
-                'start': {
-                    'dateTime': sleep_session.sleep_time.isoformat(),
-                    'timeZone': self.user_profile.timezone if self.user_profile else 'UTC',
-                },
-                'end': {
-                    'dateTime': sleep_session.wake_time.isoformat(),
-                    'timeZone': self.user_profile.timezone if self.user_profile else 'UTC',
-                },
-                'colorId': '9',
-                'transparency': 'transparent',  # Don't show as busy
-            }
-
-            event_result = service.events().insert(calendarId='primary', body=event).execute()
+            event = self._build_event(sleep_session)
+            event_result = self.events.insert(calendarId='primary', body=event).execute()
             return event_result.get('id')
 
         except HttpError as error:
@@ -157,23 +353,8 @@ class GoogleCalendarService:
             return None
 
         try:
-            event = {
-                'summary': f"Sleep ({sleep_session.duration_hours}h)",
-                'description': f"Sleep Quality: {sleep_session.get_quality_rating_display() if getattr(sleep_session, 'quality_rating', None) else 'Not rated'}\n"
-                               f"Notes: {sleep_session.notes}",
-                'start': {
-                    'dateTime': sleep_session.sleep_time.isoformat(),
-                    'timeZone': self.user_profile.timezone if self.user_profile else 'UTC',
-                },
-                'end': {
-                    'dateTime': sleep_session.wake_time.isoformat(),
-                    'timeZone': self.user_profile.timezone if self.user_profile else 'UTC',
-                },
-                'colorId': '9',
-                'transparency': 'transparent',
-            }
-
-            event_result = service.events().update(
+            event = self._build_event(sleep_session)
+            event_result = self.events.update(
                 calendarId='primary',
                 eventId=event_id,
                 body=event
@@ -197,12 +378,68 @@ class GoogleCalendarService:
             return False
 
         try:
-            service.events().delete(calendarId='primary', eventId=event_id).execute()
+            self.events.delete(calendarId='primary', eventId=event_id).execute()
             return True
         except HttpError as error:
             print(f"An error occurred deleting event: {error}")
             return False
 
+    def bulk_sync_sleep_events(self, sessions):
+        """
+        Create or update calendar events for many sleep sessions using batch requests
+        Args:
+         sessions: Iterable of SleepSession model instances
+        Returns:
+         Number of sessions synced
+        """
+        service = self.get_service(interactive=False)
+        if not service:
+            return 0
+
+        pending = {}
+        updated = []
+
+        def on_event_synced(request_id, response, exception):
+            if exception is not None:
+                print(f"An error occurred syncing event: {exception}")
+                return
+            sleep_session = pending[request_id]
+            sleep_session.calendar_event_id = response.get('id')
+            sleep_session.synced_to_calendar = True
+            updated.append(sleep_session)
+
+        def flush(batch):
+            try:
+                batch.execute()
+            except HttpError as error:
+                print(f"An error occurred executing batch: {error}")
+            pending.clear()
+
+        batch = service.new_batch_http_request(callback=on_event_synced)
+        for sleep_session in sessions:
+            request_id = str(sleep_session.pk)
+            pending[request_id] = sleep_session
+            event = self._build_event(sleep_session)
+            if sleep_session.synced_to_calendar and sleep_session.calendar_event_id:
+                request = self.events.update(
+                    calendarId='primary',
+                    eventId=sleep_session.calendar_event_id,
+                    body=event
+                )
+            else:
+                request = self.events.insert(calendarId='primary', body=event)
+            batch.add(request, request_id=request_id)
+            if len(pending) == BATCH_SIZE:
+                flush(batch)
+                batch = service.new_batch_http_request(callback=on_event_synced)
+
+        if pending:
+            flush(batch)
+
+        if updated:
+            SleepSession.objects.bulk_update(updated, ['calendar_event_id', 'synced_to_calendar'])
+        return len(updated)
+
     def list_upcoming_events(self, max_results=10):
         """
         List upcoming calendar events
@@ -216,8 +453,8 @@ class GoogleCalendarService:
             return []
 
         try:
-            now = datetime.utcnow().isoformat() + 'Z'
-            events_result = service.events().list(
+            now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            events_result = self.events.list(
                 calendarId='primary',
                 timeMin=now,
                 maxResults=max_results,
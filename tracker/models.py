@@ -4,6 +4,7 @@ Sleep Tracker Models
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import ExtractHour, ExtractMinute
 from django.utils import timezone
 
 class UserProfile(models.Model):
@@ -21,7 +22,7 @@ class UserProfile(models.Model):
     notification_enabled = models.BooleanField(default=True)
     notification_time = models.TimeField(null=True, blank=True, help_text="Time to receive daily sleep reminders")
     google_calendar_enabled = models.BooleanField(default=False)
-    google_refresh_token = models.TextField(blank True, null True)
+    google_refresh_token = models.TextField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -76,14 +77,34 @@ class SleepSession(models. Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the loaded timing so save() can tell if it changed
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_timing = (
+            instance.__dict__.get('sleep_time'),
+            instance.__dict__.get('wake_time'),
+        )
+        return instance
+
     def save(self, *args, **kwargs):
         """
-        Calculate duration before saving
+        Calculate duration before saving, only when the timing changed
         """
-        if self.sleep_time and self.wake_time:
+        timing = (self.sleep_time, self.wake_time)
+        if self.sleep_time and self.wake_time and (
+            self.duration_hours is None or timing != getattr(self, '_loaded_timing', None)
+        ):
             duration = self.wake_time - self.sleep_time
             self.duration_hours = round(duration.total_seconds() / 3600, 2)
+
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'duration_hours' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'duration_hours']
         super().save(*args, **kwargs)
+        self._loaded_timing = timing
 
     def __str__(self):
         return f"{self.user.username} - {self.sleep_time.date()} ({self.duration_hours}h)"
@@ -95,6 +116,11 @@ class SleepSession(models. Model):
         indexes = [
             models.Index(fields=['-sleep_time']),
             models.Index(fields=['user', '-sleep_time']),
+            models.Index(
+                fields=['user', 'synced_to_calendar'],
+                condition=models.Q(synced_to_calendar=False),
+                name='unsynced_sessions'
+            ),
         ]
 
 class SleepGoal (models.Model):
@@ -113,9 +139,10 @@ class SleepGoal (models.Model):
     )
 
     #Days of week (for different schedules on weekdays vs weekends) 
-    days_of_week = models.JSONField(
-        default=list,
-        help_text="List of days this goal applies to (8-Monday, 6-Sunday)"
+    days_of_week = models.PositiveSmallIntegerField(
+        default=0,
+        validators=[MaxValueValidator(127)],
+        help_text="Bitmask of days this goal applies to (bit 0-Monday, bit 6-Sunday)"
     )
 
     is_active = models.BooleanField(default=True)
@@ -123,6 +150,19 @@ class SleepGoal (models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @staticmethod
+    def days_to_mask(days):
+        """
+        Convert a list of weekday numbers (0-Monday, 6-Sunday) to a bitmask
+        """
+        return sum(1 << day for day in set(days))
+
+    def applies_on(self, weekday):
+        """
+        Whether this goal applies on the given weekday (0-Monday, 6-Sunday)
+        """
+        return bool(self.days_of_week & (1 << weekday))
+
     def __str__(self):
         return f"{self.user.username}'s Goal: {self.target_bedtime} - {self.target_wake_time}"
 
@@ -134,7 +174,7 @@ class SleepReminder(models.Model):
     """
     Scheduled reminders for sleep tracking
     """
-    REMINDER TYPE_CHOICES = [
+    REMINDER_TYPE_CHOICES = [
     ('bedtime', 'Bedtime Reminder'),
     ('wake', 'Wake Time Reminder'),
     ('log', 'Log Sleep Reminder'),
@@ -143,6 +183,14 @@ class SleepReminder(models.Model):
     user = models.ForeignKey (User, on_delete=models.CASCADE, related_name='sleep_reminders')
     reminder_type = models.CharField(max_length=20, choices=REMINDER_TYPE_CHOICES)
     reminder_time = models.TimeField()
+    # Computed by the database, so bulk writes and queryset.update() can't
+    # leave it out of step with reminder_time
+    reminder_minute_of_day = models.GeneratedField(
+        expression=ExtractHour('reminder_time') * 60 + ExtractMinute('reminder_time'),
+        output_field=models.PositiveSmallIntegerField(),
+        db_persist=True,
+        help_text="reminder_time as minutes past midnight"
+    )
 
     is_active = models.BooleanField(default=True)
     message = models.TextField(blank=True, help_text="Custom reminder message")
@@ -153,12 +201,42 @@ class SleepReminder(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models. DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the loaded schedule so the reminder index can drop the old slot
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_schedule = (
+            instance.__dict__.get('reminder_type'),
+            instance.__dict__.get('reminder_minute_of_day'),
+        )
+        return instance
+
+    @staticmethod
+    def minute_of_day(value):
+        """
+        Minutes past midnight for a time or datetime
+        """
+        return value.hour * 60 + value.minute
+
+    def save(self, *args, **kwargs):
+        """
+        Mirror the database's reminder_minute_of_day on the instance, as
+        Django doesn't read generated fields back after an UPDATE
+        """
+        self.reminder_minute_of_day = self.minute_of_day(self.reminder_time)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.user.username} - {self.get_reminder_type_display()} at {self.reminder_time}"
 
     class Meta:
         verbose_name = "Sleep Reminder"
         verbose_name_plural = "Sleep Reminders"
+        indexes = [
+            models.Index(fields=['reminder_minute_of_day', 'reminder_type', 'is_active']),
+        ]
 
 class SleepStatistics (models.Model):
     """
@@ -177,7 +255,7 @@ class SleepStatistics (models.Model):
     total_sleep_hours = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     average_sleep_hours = models.DecimalField(max_digits=4, decimal_places=2, default=0)
     average_quality = models. DecimalField(
-        max_digits=3
+        max_digits=3,
         decimal_places=2,
         null=True,
         blank=True
@@ -196,10 +274,13 @@ class SleepStatistics (models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.user.username} - {self.period type} stats for {self.date}"
+        return f"{self.user.username} - {self.period_type} stats for {self.date}"
 
     class Meta:
         verbose_name = "Sleep Statistics"
         verbose_name_plural = "Sleep Statistics"
         unique_together = ['user', 'date', 'period_type']
-        ordering = ['-date']
\ No newline at end of file
+        ordering = ['-date']
+        indexes = [
+            models.Index(fields=['user', 'period_type', '-date'], name='stats_user_period_date'),
+        ]
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+Serializers for AmbiDream
+"""
+from rest_framework import serializers
+from .models import UserProfile, SleepSession, SleepGoal, SleepReminder, SleepStatistics
+
+
+class UserProfileSerializer(serializers.ModelSerializer):
+    """
+    Serializer for UserProfile
+    """
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = UserProfile
+        fields = [
+            'id', 'username', 'target_sleep_hours', 'timezone',
+            'notification_enabled', 'notification_time',
+            'google_calendar_enabled', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['google_calendar_enabled', 'created_at', 'updated_at']
+
+
+class SleepSessionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for SleepSession
+    """
+    quality_display = serializers.CharField(source='get_quality_rating_display', read_only=True)
+
+    class Meta:
+        model = SleepSession
+        fields = [
+            'id', 'sleep_time', 'wake_time', 'quality_rating', 'quality_display',
+            'notes', 'duration_hours', 'synced_to_calendar', 'calendar_event_id',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'duration_hours', 'synced_to_calendar', 'calendar_event_id',
+            'created_at', 'updated_at'
+        ]
+
+
+class SleepSessionCreateSerializer(serializers.ModelSerializer):
+    """
+    Serializer for logging a new SleepSession
+    """
+
+    class Meta:
+        model = SleepSession
+        fields = ['id', 'sleep_time', 'wake_time', 'quality_rating', 'notes', 'duration_hours']
+        read_only_fields = ['duration_hours']
+
+    def validate(self, data):
+        if data['wake_time'] <= data['sleep_time']:
+            raise serializers.ValidationError("Wake time must be after sleep time")
+        return data
+
+
+class WeekdaysField(serializers.ListField):
+    """
+    SleepGoal.days_of_week as a list of weekday numbers (0-Monday, 6-Sunday)
+    """
+    child = serializers.IntegerField(min_value=0, max_value=6)
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, goal):
+        return [day for day in range(7) if goal.applies_on(day)]
+
+    def to_internal_value(self, data):
+        return {'days_of_week': SleepGoal.days_to_mask(super().to_internal_value(data))}
+
+
+class SleepGoalSerializer(serializers.ModelSerializer):
+    """
+    Serializer for SleepGoal
+    """
+    days_of_week = WeekdaysField(required=False)
+
+    class Meta:
+        model = SleepGoal
+        fields = [
+            'id', 'target_bedtime', 'target_wake_time', 'target_duration_hours',
+            'days_of_week', 'is_active', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['created_at', 'updated_at']
+
+
+class SleepReminderSerializer(serializers.ModelSerializer):
+    """
+    Serializer for SleepReminder
+    """
+
+    class Meta:
+        model = SleepReminder
+        fields = [
+            'id', 'reminder_type', 'reminder_time', 'is_active', 'message',
+            'last_sent', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['last_sent', 'created_at', 'updated_at']
+
+
+class SleepStatisticsSerializer(serializers.ModelSerializer):
+    """
+    Serializer for SleepStatistics (read-only)
+    """
+
+    class Meta:
+        model = SleepStatistics
+        fields = [
+            'id', 'date', 'period_type', 'total_sleep_hours', 'average_sleep_hours',
+            'average_quality', 'sessions_count', 'goal_achievement_rate'
+        ]
+        read_only_fields = fields
@@ -1,10 +1,15 @@
 """
 Django signals for Sleep Tracker
 """
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, SleepReminder, SleepSession, SleepStatistics
+from .cache import (
+    invalidate_statistics, invalidate_summary,
+    remove_from_reminder_index, update_reminder_index
+)
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, ** kwargs) :
@@ -14,10 +19,64 @@ def create_user_profile(sender, instance, created, ** kwargs) :
     if created:
         UserProfile.objects.create(user=instance)
 
-    @receiver (post_save, sender=User)
-    def save_user_profile(sender, instance, **kwargs):
-        """
-        Save the UserProfile whenever the User is saved
-        """
+
+@receiver(post_save, sender=User)
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Save the UserProfile whenever the User is saved
+    """
+    # Partial saves (e.g. last_login on login) don't touch the profile
+    if created or update_fields:
+        return
     if hasattr(instance, 'profile'):
-        instance.profile.save()
\ No newline at end of file
+        instance.profile.save()
+
+
+@receiver(post_save, sender=SleepStatistics)
+@receiver(post_delete, sender=SleepStatistics)
+def invalidate_cached_statistics(sender, instance, **kwargs):
+    """
+    Drop cached statistics responses when a user's statistics change
+    """
+    invalidate_statistics(instance.user_id)
+
+
+
+# Session fields the 30-day summary is computed from
+SUMMARY_FIELDS = {'sleep_time', 'duration_hours', 'quality_rating'}
+
+
+@receiver(post_save, sender=SleepSession)
+@receiver(post_delete, sender=SleepSession)
+def invalidate_cached_summary(sender, instance, update_fields=None, **kwargs):
+    """
+    Drop the cached summary when a session it covers changes
+    """
+    # Calendar sync saves only the sync fields, which the summary ignores
+    if update_fields and not SUMMARY_FIELDS.intersection(update_fields):
+        return
+    invalidate_summary(instance.user_id)
+
+
+
+@receiver(post_save, sender=SleepReminder)
+def index_reminder(sender, instance, **kwargs):
+    """
+    Keep the per-minute reminder sets in step with the reminder's schedule
+    """
+    # Only touch Redis for committed rows, so a rollback can't leave a member behind
+    transaction.on_commit(lambda: update_reminder_index(instance))
+
+
+@receiver(post_delete, sender=SleepReminder)
+def unindex_reminder(sender, instance, **kwargs):
+    """
+    Drop a deleted reminder from the per-minute reminder sets
+    """
+    # delete() clears the pk afterwards, so capture what the callback needs now
+    reminder_id = instance.pk
+    schedules = {(instance.reminder_type, instance.reminder_minute_of_day)}
+    loaded = getattr(instance, '_loaded_schedule', None)
+    if loaded:
+        schedules.add(loaded)
+    transaction.on_commit(lambda: remove_from_reminder_index(reminder_id, schedules))
@@ -1,100 +1,145 @@
 """
 Celery tasks for AmbiDream 
 """
-from celery import shared_task
-from django.contrib.auth.models import User
+import logging
+from celery import group, shared_task
+from celery.signals import worker_init
+from django.db.models import Avg, Count, Sum
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import timedelta
 from .models import SleepReminder, SleepSession, SleepStatistics, UserProfile
-from .notifications import EmailNotificationService
-from .google_calendar import GoogleCalendarService
+from .cache import due_reminder_ids, invalidate_statistics
+from .notifications import EmailBatchInterrupted, EmailNotificationService, preload_email_templates
+from .google_calendar import BATCH_SIZE as CALENDAR_BATCH_SIZE, GoogleCalendarService
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def send_bedtime_reminders():
-    """"
-    Send bedtime reminders to users
+
+@worker_init.connect
+def warm_email_templates(**kwargs):
     """
-    current_time = timezone.now().time()
-    reminders = SleepReminder.objects.filter(
-        reminder_type='bedtime',
-        is_active=True,
-        reminder_time__hour=current_time.hour,
-        reminder_time_minute=current_time.minute
-    )
+    Compile the email templates in the worker's main process before the pool
+    forks, so every child, including ones recycled by max-tasks-per-child,
+    starts with them already parsed
+    """
+    preload_email_templates()
 
-    sent_count = 0
-    for reminder in reminders:
-        if reminder.user.profile.notification_enabled:
-            result = EmailNotificationService.send_bedtime_reminder(
-            reminder.user,
-            reminder.reminder_time
-            )
-        if result:
-            reminder.last_sent = timezone.now()
-            reminder.save()
-            sent_count += 1
 
-    return f"Sent {sent_count} bedtime reminders"
+# Sessions younger than this are left to the sync queued when they were saved
+CALENDAR_RECONCILE_MIN_AGE = timedelta(minutes=10)
 
-@shared_task
-def send_wake_reminders():
-    """"
-    Send wake time reminders to users
+# Emails sent per fan-out task, each batch sharing one SMTP connection
+EMAIL_BATCH_SIZE = 50
+
+# Retry policy for tasks that send email; SMTPException is an OSError, as
+# are the socket errors raised while connecting
+EMAIL_RETRY_OPTIONS = {
+    'autoretry_for': (OSError,),
+    'retry_backoff': True,
+    'max_retries': 3,
+}
+
+
+def _batched(ids, size=EMAIL_BATCH_SIZE):
     """
-    current_time = timezone.now().time()
-    reminders = SleepReminder.objects.filter(
-        reminder_type='wake',
-        is_active=True,
-        reminder_time_hour=current_time.hour,
-        reminder_time_minute=current_time.minute
-    )
+    Split a list of IDs into lists of at most `size` items
+    """
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
 
-    sent_count = 0
+@shared_task(bind=True, **EMAIL_RETRY_OPTIONS)
+def send_reminder_batch(self, reminder_ids, reminder_type, minute_of_day):
+    """
+    Send a batch of reminders over a single SMTP connection
+    Args:
+     reminder_ids: IDs of the SleepReminders to send
+     reminder_type: Type the reminders were queued for
+     minute_of_day: Minute of the day the reminders were queued for
+    """
+    # A late dispatch can queue the same minute twice, so skip reminders
+    # already sent since the most recent occurrence of that minute
+    now = timezone.now()
+    occurrence = now.replace(hour=minute_of_day // 60, minute=minute_of_day % 60, second=0, microsecond=0)
+    if occurrence > now:
+        occurrence -= timedelta(days=1)
+
+    # The IDs come from the Redis index, so confirm each row still matches
+    reminders = list(SleepReminder.objects.filter(
+        id__in=reminder_ids,
+        reminder_type=reminder_type,
+        reminder_minute_of_day=minute_of_day,
+        is_active=True,
+        user__profile__notification_enabled=True
+    ).exclude(last_sent__gte=occurrence).select_related('user'))
+
+    # Users who already logged sleep for yesterday, fetched in one query
+    yesterday = now.date() - timedelta(days=1)
+    logged_user_ids = set(SleepSession.objects.filter(
+        user__in=[reminder.user_id for reminder in reminders if reminder.reminder_type == 'log'],
+        sleep_time__date=yesterday
+    ).values_list('user_id', flat=True))
+
+    pending = []
+    messages = []
     for reminder in reminders:
-        if reminder.user.profile.notification_enabled:
-            result = EmailNotificationService.send_wake_reminder(
-                reminder.user,
-                reminder.reminder_time
-            )
-            if result:
-                reminder.last_sent = timezone.now()
-                reminder.save()
-                sent_count += 1
+        if reminder.reminder_type == 'bedtime':
+            message = EmailNotificationService.build_bedtime_reminder(reminder.user, reminder.reminder_time)
+        elif reminder.reminder_type == 'wake':
+            message = EmailNotificationService.build_wake_reminder(reminder.user, reminder.reminder_time)
+        elif reminder.user_id not in logged_user_ids:
+            message = EmailNotificationService.build_log_reminder(reminder.user)
+        else:
+            continue
+        pending.append(reminder)
+        messages.append(message)
 
-    return f"Sent {sent_count} wake reminders"
+    try:
+        results = EmailNotificationService.send_messages(messages)
+    except EmailBatchInterrupted as e:
+        # Record what went out and retry only the rest, so nobody gets a duplicate
+        _mark_reminders_sent(pending, e.results)
+        unsent_ids = [reminder.id for reminder in pending[len(e.results):]]
+        raise self.retry(
+            args=[unsent_ids, reminder_type, minute_of_day],
+            exc=e,
+            countdown=2 ** self.request.retries
+        )
 
-@shared_task
-def send_log_reminders():
+    sent_ids = _mark_reminders_sent(pending, results)
+    return f"Sent {len(sent_ids)} reminders"
+
+
+def _mark_reminders_sent(reminders, results):
     """
-    Send reminders to log sleep sessions
+    Set last_sent on the reminders whose emails were sent
+    Args:
+     reminders: SleepReminders in the order their messages were sent
+     results: Sent flags from EmailNotificationService.send_messages
+    Returns:
+     IDs of the reminders marked as sent
     """
-    current_time = timezone.now().time()
-    reminders = SleepReminder.objects.filter(
-        reminder_type='log',
-        is_active=True,
-        reminder_time_hour=current_time.hour,
-        reminder_time_minute=current_time.minute
-    )
+    sent_ids = [reminder.id for reminder, sent in zip(reminders, results) if sent]
+    SleepReminder.objects.filter(id__in=sent_ids).update(last_sent=timezone.now())
+    return sent_ids
 
-    sent_count = 0
-    for reminder in reminders:
-        if reminder.user.profile.notification_enabled:
-            # Check if user has logged sleep for yesterday
-            yesterday = timezone.now().date() - timedelta(days=1)
-            has_logged = SleepSession.objects.filter(
-                user=reminder.user,
-                sleep_time__date=yesterday
-            ).exists()
 
-            if not has_logged:
-                result = EmailNotificationService.send_log_reminder(reminder.user)
-                if result:
-                    reminder.last_sent = timezone.now()
-                    reminder.save()
-                    sent_count += 1
+@shared_task
+def send_reminders(reminder_type):
+    """
+    Queue send_reminder_batch tasks for every reminder of a type due this minute
+    Args:
+     reminder_type: 'bedtime', 'wake' or 'log'
+    """
+    # Read from the Redis reminder sets; send_reminder_batch re-checks the rows
+    minute_of_day = SleepReminder.minute_of_day(timezone.now())
+    reminder_ids = due_reminder_ids(reminder_type, minute_of_day)
 
-    return f"Sent {sent_count} log reminders"
+    if reminder_ids:
+        group(
+            send_reminder_batch.s(batch, reminder_type, minute_of_day)
+            for batch in _batched(reminder_ids)
+        ).apply_async()
+    return f"Queued {len(reminder_ids)} {reminder_type} reminders"
 
 
 @shared_task
@@ -105,7 +150,14 @@ def sync_sleep_to_calendar(sleep_session_id):
      sleep_session_id: ID of the SleepSession to sync
     """
     try:
-        sleep_session = SleepSession.objects.get(id=sleep_session_id)
+        # One JOIN for the session and profile, loading only what the sync uses
+        sleep_session = SleepSession.objects.select_related('user__profile').only(
+            'sleep_time', 'wake_time', 'duration_hours', 'quality_rating', 'notes',
+            'synced_to_calendar', 'calendar_event_id',
+            'user__profile__timezone',
+            'user__profile__google_calendar_enabled',
+            'user__profile__google_refresh_token',
+        ).get(id=sleep_session_id)
         user_profile = sleep_session.user.profile
 
         if not user_profile.google_calendar_enabled:
@@ -126,7 +178,7 @@ def sync_sleep_to_calendar(sleep_session_id):
             if event_id:
                 sleep_session.calendar_event_id = event_id
                 sleep_session.synced_to_calendar = True
-                sleep_session.save()
+                sleep_session.save(update_fields=['calendar_event_id', 'synced_to_calendar'])
                 return f"Created calendar event: {event_id}"
         
             return "Failed to sync to calendar"
@@ -137,42 +189,131 @@ def sync_sleep_to_calendar(sleep_session_id):
         return f"Error syncing to calendar: {str(e)}"
 
 
+# Rows fetched and upserted per round trip by the statistics tasks
+STATISTICS_BATCH_SIZE = 500
+
+
+def _upsert_statistics(stats):
+    """
+    Insert or update a batch of SleepStatistics rows in one query
+    Args:
+     stats: List of unsaved SleepStatistics instances
+    """
+    SleepStatistics.objects.bulk_create(
+        stats,
+        batch_size=STATISTICS_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['user', 'date', 'period_type'],
+        update_fields=['total_sleep_hours', 'average_sleep_hours', 'average_quality', 'sessions_count', 'updated_at']
+    )
+
+    # bulk_create skips post_save, so drop cached statistics here
+    for stat in stats:
+        invalidate_statistics(stat.user_id)
+
+
+def _save_statistics(sessions, date, period_type):
+    """
+    Aggregate sessions per user in the database and upsert SleepStatistics
+    Args:
+     sessions: SleepSession queryset covering the period
+     date: Date the statistics are stored under
+     period_type: 'daily', 'weekly' or 'monthly'
+    Returns:
+     Number of statistics rows written
+    """
+    rows = sessions.order_by().values('user_id').annotate(
+        total_hours=Sum('duration_hours'),
+        avg_quality=Avg('quality_rating'),
+        sessions_count=Count('id')
+    )
+
+    stats = []
+    saved_count = 0
+    for row in rows.iterator(chunk_size=STATISTICS_BATCH_SIZE):
+        total_hours = row['total_hours'] or 0
+        stats.append(SleepStatistics(
+            user_id=row['user_id'],
+            date=date,
+            period_type=period_type,
+            total_sleep_hours=total_hours,
+            average_sleep_hours=total_hours / row['sessions_count'],
+            average_quality=row['avg_quality'],
+            sessions_count=row['sessions_count']
+        ))
+
+        if len(stats) == STATISTICS_BATCH_SIZE:
+            _upsert_statistics(stats)
+            saved_count += len(stats)
+            stats = []
+
+    if stats:
+        _upsert_statistics(stats)
+        saved_count += len(stats)
+
+    return saved_count
+
+
+@shared_task
+def sync_sleep_sessions_to_calendar(sleep_session_ids):
+    """
+    Sync many sleep sessions to Google Calendar using batch requests
+    Args:
+     sleep_session_ids: IDs of the SleepSessions to sync
+    """
+    sessions = SleepSession.objects.filter(
+        id__in=sleep_session_ids,
+        user__profile__google_calendar_enabled=True
+    ).select_related('user__profile')
+
+    # One calendar service per user, each sending its sessions in batches
+    sessions_by_profile = {}
+    for sleep_session in sessions:
+        profile = sleep_session.user.profile
+        sessions_by_profile.setdefault(profile.pk, (profile, []))[1].append(sleep_session)
+
+    synced_count = 0
+    for profile, profile_sessions in sessions_by_profile.values():
+        calendar_service = GoogleCalendarService(profile)
+        try:
+            # Workers can't run the browser OAuth flow; the user has to reconnect
+            if not calendar_service.get_service(interactive=False):
+                logger.warning("Skipping calendar sync for profile %s: no valid Google credentials", profile.pk)
+                continue
+            synced_count += calendar_service.bulk_sync_sleep_events(profile_sessions)
+        except Exception:
+            logger.exception("Error syncing sessions for profile %s", profile.pk)
+
+    return f"Synced {synced_count} sleep sessions to calendar"
+
+
+@shared_task
+def sync_unsynced_sessions_to_calendar():
+    """
+    Queue batched calendar syncs for every session not yet pushed to Google Calendar
+    """
+    # Newer sessions may still have their sync_sleep_to_calendar queued;
+    # syncing them here too would insert a second event
+    sleep_session_ids = list(SleepSession.objects.filter(
+        synced_to_calendar=False,
+        created_at__lt=timezone.now() - CALENDAR_RECONCILE_MIN_AGE,
+        user__profile__google_calendar_enabled=True
+    ).order_by('user_id').values_list('id', flat=True))
+
+    for batch in _batched(sleep_session_ids, CALENDAR_BATCH_SIZE):
+        sync_sleep_sessions_to_calendar.delay(batch)
+    return f"Queued {len(sleep_session_ids)} sleep sessions for calendar sync"
+
+
 @shared_task
 def calculate_daily_statistics():
     """
     Calculate daily sleep statistics for all users
     """
     yesterday = timezone.now().date() - timedelta(days=1)
-    users = User.objects.filter(sleep_sessions__sleep_time__date=yesterday).distinct()
-
-    stats_created = 0
-    for user in users:
-        sessions = SleepSession.objects.filter(
-            user=user,
-            sleep_time__date=yesterday
-        )
-
-        if sessions.exists():
-            total_hours = sum(s.duration_hours or 0 for s in sessions)
-            avg_hours = total_hours / sessions.count()
-            quality_sessions = sessions.filter(quality_rating__isnull=False)
-            avg_quality = None
-            if quality_sessions.exists():
-                avg_quality = sum(s.quality_rating for s in quality_sessions) / quality_sessions.count()
-
-            SleepStatistics.objects.update_or_create(
-                user=user,
-                date=yesterday,
-                period_type='daily',
-                defaults={
-                    'total_sleep_hours': total_hours,
-                    'average_sleep_hours': avg_hours,
-                    'average_quality': avg_quality,
-                    'sessions_count': sessions.count()
-                }
-            )
-            stats_created += 1
+    sessions = SleepSession.objects.filter(sleep_time__date=yesterday)
 
+    stats_created = _save_statistics(sessions, yesterday, 'daily')
     return f"Created/updated {stats_created} daily statistics"
 
 @shared_task
@@ -184,42 +325,48 @@ def calculate_weekly_statistics():
     week_start = today - timedelta(days=today.weekday()) # Monday
     week_end = week_start + timedelta(days=6) # Sunday
 
-    users = User.objects. filter(
-        sleep_sessions__sleep_time__date__gte=week_start,
-        sleep_sessions__sleep_time__date__lte=week_end
-    ).distinct()
-
-    stats_created = 0
-    for user in users:
-        sessions = SleepSession.objects.filter(
-            user=user,
-            sleep_time__date__gte=week_start,
-            sleep_time__date__lte=week_end
-        )
-
-        if sessions.exists():
-            total_hours = sum(s.duration_hours or 0 for s in sessions)
-            avg_hours = total_hours / sessions.count()
-            quality_sessions = sessions.filter(quality_rating__isnull=False)
-            avg_quality = None
-            if quality_sessions.exists():
-                avg_quality = sum(s.quality_rating for s in quality_sessions) / quality_sessions.count()
-            
-            SleepStatistics.objects.update_or_create(
-                user=user,
-                date=week_start,
-                period_type='weekly',
-                defaults={
-                    'total_sleep_hours'; total_hours,
-                    'average_sleep_hours': avg_hours,
-                    'average_quality': avg_quality,
-                    'sessions_count': sessions.count()
-                }
-            )
-            stats_created += 1
+    sessions = SleepSession.objects.filter(
+        sleep_time__date__gte=week_start,
+        sleep_time__date__lte=week_end
+    )
 
+    stats_created = _save_statistics(sessions, week_start, 'weekly')
     return f"Created/updated {stats_created} weekly statistics"
 
+@shared_task(bind=True, **EMAIL_RETRY_OPTIONS)
+def send_weekly_report_batch(self, stat_ids):
+    """
+    Send weekly reports for a batch of statistics over a single SMTP connection
+    Args:
+     stat_ids: IDs of weekly SleepStatistics to report on
+    """
+    stats = SleepStatistics.objects.filter(
+        id__in=stat_ids,
+        user__profile__notification_enabled=True
+    ).select_related('user')
+    now = timezone.now()
+
+    reported_ids = []
+    messages = []
+    for stat in stats:
+        statistics = {
+            'avg_hours': float (stat.average_sleep_hours),
+            'sessions': stat.sessions_count,
+            'avg_quality': float(stat.average_quality) if stat.average_quality else 0,
+            'goal_achievement': float(stat.goal_achievement_rate) if stat.goal_achievement_rate else 0
+        }
+        reported_ids.append(stat.id)
+        messages.append(EmailNotificationService.build_weekly_report(stat.user, statistics, now=now))
+
+    try:
+        sent_count = sum(EmailNotificationService.send_messages(messages))
+    except EmailBatchInterrupted as e:
+        # Retry only the reports that didn't go out
+        unsent_ids = reported_ids[len(e.results):]
+        raise self.retry(args=[unsent_ids], exc=e, countdown=2 ** self.request.retries)
+
+    return f"Sent {sent_count} weekly reports"
+
 @shared_task
 def send_weekly_reports():
     """
@@ -228,26 +375,12 @@ def send_weekly_reports():
     today = timezone.now().date()
     week_start = today - timedelta(days=today.weekday() + 7) # Last Monday
 
-    stats = SleepStatistics.objects.filter(
+    stat_ids = list(SleepStatistics.objects.filter(
         date=week_start,
-        period_type='weekly'
-    )
-
-    sent_count = 0
-    for stat in stats:
-        if stat.user.profile.notification_enabled:
-            statistics = {
-                'avg_hours': float (stat.average_sleep_hours),
-                'sessions': stat.sessions_count,
-                'avg_quality': float(stat.average_quality) if stat.average_quality else 0,
-                'goal_achievement': float(stat.goal_achievement_rate) if stat.goal_achievement_rate else 0
-            }
-
-        result = EmailNotificationService.send_weekly_report(
-            stat.user,
-            statistics
-        )
-        if result:
-            sent_count += 1
+        period_type='weekly',
+        user__profile__notification_enabled=True
+    ).values_list('id', flat=True))
 
-    return f"Sent {sent_count} weekly reports"
\ No newline at end of file
+    if stat_ids:
+        group(send_weekly_report_batch.s(batch) for batch in _batched(stat_ids)).apply_async()
+    return f"Queued {len(stat_ids)} weekly reports"
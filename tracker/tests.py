@@ -1,3 +1,755 @@
-from django.test import TestCase
+"""
+Tests for Sleep Tracker
+"""
+import smtplib
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+import redis
+from celery.exceptions import Retry
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from sleepyapp.celery import app
+
+from . import cache as tracker_cache, google_calendar, tasks
+from .admin import ApproxCountPaginator
+from .google_calendar import GoogleCalendarService
+from .models import SleepGoal, SleepReminder, SleepSession, SleepStatistics, UserProfile
+from .notifications import EmailNotificationService
+from .serializers import SleepGoalSerializer
+from .tasks import _save_statistics, send_reminder_batch, sync_sleep_sessions_to_calendar
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the redis-py calls the reminder index makes
+    """
+
+    def __init__(self):
+        self.sets = {}
+
+    def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(str(member).encode() for member in members)
+
+    def srem(self, key, *members):
+        members = {str(member).encode() for member in members}
+        remaining = self.sets.get(key, set()) - members
+        if remaining:
+            self.sets[key] = remaining
+        else:
+            # Redis drops a set once its last member is removed
+            self.sets.pop(key, None)
+
+    def delete(self, key):
+        self.sets.pop(key, None)
+
+    def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """
+    Buffers commands until execute(), like a redis-py pipeline
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        for name, args in self.commands:
+            getattr(self.client, name)(*args)
+        self.commands = []
+
+
+class FlakyEmailBackend(EmailBackend):
+    """
+    locmem backend whose connection drops after a set number of messages
+    """
+    fail_after = 2
+
+    def send_messages(self, messages):
+        if len(mail.outbox) >= self.fail_after:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        return super().send_messages(messages)
+
+
+def make_credentials(token, expires_in):
+    # google-auth keeps expiry as a naive UTC datetime
+    expiry = datetime.now(dt_timezone.utc).replace(tzinfo=None) + expires_in
+    return Credentials(
+        token=token,
+        refresh_token='refresh',
+        token_uri='https://oauth2.googleapis.com/token',
+        client_id='client',
+        client_secret='secret',
+        expiry=expiry
+    )
+
+
+def fake_refresh(creds, request):
+    creds.token = 'refreshed'
+    creds.expiry = datetime.now(dt_timezone.utc).replace(tzinfo=None) + timedelta(hours=1)
+
+
+class FakeBatch:
+    """
+    Stand-in for BatchHttpRequest that answers each request on execute()
+    """
+
+    def __init__(self, callback, failing_ids):
+        self.callback = callback
+        self.failing_ids = failing_ids
+        self.request_ids = []
+
+    def add(self, request, request_id):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        for request_id in self.request_ids:
+            if request_id in self.failing_ids:
+                error = HttpError(mock.Mock(status=403, reason='Forbidden'), b'')
+                self.callback(request_id, None, error)
+            else:
+                self.callback(request_id, {'id': f'event-{request_id}'}, None)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SleepSessionSaveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper', 'sleeper@example.com')
+        self.sleep_time = datetime(2025, 1, 1, 22, 0, tzinfo=dt_timezone.utc)
+        self.session = SleepSession.objects.create(
+            user=self.user,
+            sleep_time=self.sleep_time,
+            wake_time=self.sleep_time + timedelta(hours=8)
+        )
+
+    def test_duration_calculated_on_create(self):
+        self.session.refresh_from_db()
+        self.assertEqual(float(self.session.duration_hours), 8.0)
+
+    def test_partial_save_of_timing_also_writes_duration(self):
+        session = SleepSession.objects.get(pk=self.session.pk)
+        session.wake_time = self.sleep_time + timedelta(hours=6, minutes=30)
+        session.save(update_fields=['wake_time'])
+
+        session.refresh_from_db()
+        self.assertEqual(float(session.duration_hours), 6.5)
+
+    def test_partial_save_without_timing_change_keeps_duration(self):
+        # A stored value the recalculation would overwrite
+        SleepSession.objects.filter(pk=self.session.pk).update(duration_hours=7.25)
+        session = SleepSession.objects.get(pk=self.session.pk)
+        session.notes = "Woke up once"
+        session.save(update_fields=['notes'])
+
+        session.refresh_from_db()
+        self.assertEqual(float(session.duration_hours), 7.25)
+
+
+class FakePostgresConnection:
+    vendor = 'postgresql'
+
+    def __init__(self, reltuples):
+        self.reltuples = reltuples
+
+    def cursor(self):
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value.fetchone.return_value = (self.reltuples,)
+        return cursor
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ApproxCountPaginatorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper')
+        sleep_time = datetime(2025, 1, 1, 22, 0, tzinfo=dt_timezone.utc)
+        for day in range(3):
+            SleepSession.objects.create(
+                user=self.user,
+                sleep_time=sleep_time + timedelta(days=day),
+                wake_time=sleep_time + timedelta(days=day, hours=8)
+            )
+
+    def test_exact_count_off_postgres(self):
+        paginator = ApproxCountPaginator(SleepSession.objects.all(), 10)
+        self.assertEqual(paginator.count, 3)
+
+    def test_uses_estimate_for_large_unfiltered_table(self):
+        with mock.patch('tracker.admin.connections', {'default': FakePostgresConnection(50000)}):
+            paginator = ApproxCountPaginator(SleepSession.objects.all(), 10)
+            self.assertEqual(paginator.count, 50000)
+
+    def test_exact_count_below_threshold(self):
+        with mock.patch('tracker.admin.connections', {'default': FakePostgresConnection(40)}):
+            paginator = ApproxCountPaginator(SleepSession.objects.all(), 10)
+            self.assertEqual(paginator.count, 3)
+
+    def test_exact_count_for_filtered_queryset(self):
+        with mock.patch('tracker.admin.connections', {'default': FakePostgresConnection(50000)}):
+            paginator = ApproxCountPaginator(SleepSession.objects.filter(user=self.user), 10)
+            self.assertEqual(paginator.count, 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GoogleCalendarServiceCacheTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(google_calendar, '_SERVICE_CACHE', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.profile = User.objects.create_user('sleeper').profile
+        self.profile.google_refresh_token = '{"refresh_token": "token"}'
+
+    def cached_service(self, valid):
+        service = mock.Mock()
+        service._http.credentials.valid = valid
+        google_calendar._SERVICE_CACHE[(self.profile.pk, hash(self.profile.google_refresh_token))] = service
+        return service
+
+    def test_reuses_cached_service_with_valid_credentials(self):
+        service = self.cached_service(valid=True)
+        with mock.patch.object(GoogleCalendarService, 'get_credentials') as get_credentials:
+            self.assertIs(GoogleCalendarService(self.profile).get_service(), service)
+        get_credentials.assert_not_called()
+
+    def test_rebuilds_cached_service_with_expired_credentials(self):
+        stale = self.cached_service(valid=False)
+        creds = mock.Mock()
+        with mock.patch.object(GoogleCalendarService, 'get_credentials', return_value=creds), \
+                mock.patch.object(google_calendar, 'build') as build:
+            service = GoogleCalendarService(self.profile).get_service()
+
+        self.assertIsNot(service, stale)
+        self.assertIs(service, build.return_value)
+        self.assertIs(build.call_args.kwargs['credentials'], creds)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BulkSyncSleepEventsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper')
+        sleep_time = datetime(2025, 1, 1, 22, 0, tzinfo=dt_timezone.utc)
+        self.sessions = [
+            SleepSession.objects.create(
+                user=self.user,
+                sleep_time=sleep_time + timedelta(days=day),
+                wake_time=sleep_time + timedelta(days=day, hours=8)
+            )
+            for day in range(3)
+        ]
+
+    def sync(self, sessions, failing_ids=()):
+        batches = []
+
+        def new_batch(callback):
+            batches.append(FakeBatch(callback, failing_ids))
+            return batches[-1]
+
+        service = mock.Mock()
+        service.new_batch_http_request.side_effect = new_batch
+        calendar_service = GoogleCalendarService(self.user.profile)
+        with mock.patch.object(GoogleCalendarService, 'get_service', return_value=service), \
+                mock.patch('builtins.print'):
+            synced = calendar_service.bulk_sync_sleep_events(sessions)
+        return synced, service, batches
+
+    def test_stores_event_ids_from_batch_callbacks(self):
+        synced, service, batches = self.sync(self.sessions)
+
+        self.assertEqual(synced, 3)
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(service.events.return_value.insert.call_count, 3)
+        for session in SleepSession.objects.all():
+            self.assertTrue(session.synced_to_calendar)
+            self.assertEqual(session.calendar_event_id, f'event-{session.pk}')
+
+    def test_failed_requests_stay_unsynced(self):
+        failing = self.sessions[1]
+        synced, _, _ = self.sync(self.sessions, failing_ids={str(failing.pk)})
+
+        self.assertEqual(synced, 2)
+        failing.refresh_from_db()
+        self.assertFalse(failing.synced_to_calendar)
+        self.assertIsNone(failing.calendar_event_id)
+
+    def test_synced_sessions_are_updated_not_inserted(self):
+        SleepSession.objects.filter(pk=self.sessions[0].pk).update(
+            synced_to_calendar=True, calendar_event_id='existing'
+        )
+        sessions = list(SleepSession.objects.order_by('pk'))
+        _, service, _ = self.sync(sessions)
+
+        events = service.events.return_value
+        self.assertEqual(events.update.call_args.kwargs['eventId'], 'existing')
+        self.assertEqual(events.insert.call_count, 2)
+
+    def test_splits_requests_into_batches(self):
+        with mock.patch.object(google_calendar, 'BATCH_SIZE', 2):
+            synced, _, batches = self.sync(self.sessions)
+
+        self.assertEqual(synced, 3)
+        self.assertEqual([len(batch.request_ids) for batch in batches], [2, 1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RefreshCredentialsTests(TestCase):
+    def setUp(self):
+        self.profile = User.objects.create_user('sleeper').profile
+        self.expired = make_credentials('expired', timedelta(hours=-1))
+        self.calendar_service = GoogleCalendarService(self.profile)
+        self.lock_key = f'{self.calendar_service._credentials_cache_key()}:refreshing'
+        self.addCleanup(cache.clear)
+
+    def test_refreshes_a_copy_and_writes_it_back(self):
+        with mock.patch.object(Credentials, 'refresh', autospec=True, side_effect=fake_refresh) as refresh:
+            creds = self.calendar_service._refresh_credentials(self.expired)
+
+        refresh.assert_called_once()
+        self.assertEqual(creds.token, 'refreshed')
+        self.assertEqual(self.expired.token, 'expired')
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.google_refresh_token, creds.to_json())
+        self.assertEqual(cache.get(self.calendar_service._credentials_cache_key()), creds.to_json())
+        self.assertIsNone(cache.get(self.lock_key))
+
+    def test_waits_for_the_lock_holder_instead_of_refreshing(self):
+        cache.add(self.lock_key, True)
+        fresh = make_credentials('fresh', timedelta(hours=1))
+
+        def lock_holder_finishes(seconds):
+            cache.set(self.calendar_service._credentials_cache_key(), fresh.to_json())
+
+        with mock.patch.object(Credentials, 'refresh', autospec=True) as refresh, \
+                mock.patch.object(google_calendar.time, 'sleep', side_effect=lock_holder_finishes):
+            creds = self.calendar_service._refresh_credentials(self.expired)
+
+        refresh.assert_not_called()
+        self.assertEqual(creds.token, 'fresh')
+        self.assertTrue(cache.get(self.lock_key))
+
+    def test_refreshes_itself_when_the_lock_holder_times_out(self):
+        cache.add(self.lock_key, True)
+        with mock.patch.object(Credentials, 'refresh', autospec=True, side_effect=fake_refresh) as refresh, \
+                mock.patch.object(google_calendar, 'CREDENTIALS_REFRESH_WAIT', 0):
+            creds = self.calendar_service._refresh_credentials(self.expired)
+
+        refresh.assert_called_once()
+        self.assertEqual(creds.token, 'refreshed')
+        # The lock still belongs to the worker that took it
+        self.assertTrue(cache.get(self.lock_key))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SyncSleepSessionsTaskTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper')
+        sleep_time = datetime(2025, 1, 1, 22, 0, tzinfo=dt_timezone.utc)
+        self.session = SleepSession.objects.create(
+            user=self.user,
+            sleep_time=sleep_time,
+            wake_time=sleep_time + timedelta(hours=8)
+        )
+        # Enabled, but without a stored token
+        UserProfile.objects.filter(user=self.user).update(google_calendar_enabled=True)
+
+    def test_skips_profiles_without_credentials(self):
+        with mock.patch.object(GoogleCalendarService, 'authenticate') as authenticate, \
+                mock.patch.object(GoogleCalendarService, 'bulk_sync_sleep_events') as bulk_sync, \
+                self.assertLogs('tracker.tasks', 'WARNING'):
+            result = sync_sleep_sessions_to_calendar.apply(args=[[self.session.pk]]).get()
+
+        authenticate.assert_not_called()
+        bulk_sync.assert_not_called()
+        self.assertEqual(result, "Synced 0 sleep sessions to calendar")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReminderDispatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper', 'sleeper@example.com')
+        self.reminder = SleepReminder.objects.create(
+            user=self.user, reminder_type='bedtime', reminder_time=time(22, 30)
+        )
+        # The 22:30 dispatch running late, after the minute has passed
+        self.now = datetime(2025, 1, 2, 22, 31, 10, tzinfo=dt_timezone.utc)
+
+    def send_batch(self):
+        with mock.patch.object(timezone, 'now', return_value=self.now):
+            send_reminder_batch.apply(args=[[self.reminder.pk], 'bedtime', 22 * 60 + 30])
+
+    def test_skips_reminder_already_sent_for_this_minute(self):
+        SleepReminder.objects.filter(pk=self.reminder.pk).update(
+            last_sent=datetime(2025, 1, 2, 22, 30, 5, tzinfo=dt_timezone.utc)
+        )
+        self.send_batch()
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_sends_reminder_last_sent_the_day_before(self):
+        SleepReminder.objects.filter(pk=self.reminder.pk).update(
+            last_sent=datetime(2025, 1, 1, 22, 30, 5, tzinfo=dt_timezone.utc)
+        )
+        self.send_batch()
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_dispatcher_stays_off_the_email_queue(self):
+        router = app.amqp.router
+        self.assertEqual(router.route({}, 'tracker.tasks.send_reminders')['queue'].name, 'celery')
+        self.assertEqual(router.route({}, 'tracker.tasks.send_reminder_batch')['queue'].name, 'email')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReminderIndexTests(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch.object(tracker_cache, '_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('sleeper', 'sleeper@example.com')
+
+    def create_reminder(self, reminder_time=time(22, 30), **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return SleepReminder.objects.create(
+                user=self.user,
+                reminder_type='bedtime',
+                reminder_time=reminder_time,
+                **kwargs
+            )
+
+    def members(self, minute_of_day, reminder_type='bedtime'):
+        return self.redis.smembers(tracker_cache.reminder_index_key(reminder_type, minute_of_day))
+
+    def test_save_adds_reminder_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            reminder = SleepReminder.objects.create(
+                user=self.user, reminder_type='bedtime', reminder_time=time(22, 30)
+            )
+        self.assertEqual(self.members(22 * 60 + 30), set())
+
+        for callback in callbacks:
+            callback()
+        self.assertIn(str(reminder.pk).encode(), self.members(22 * 60 + 30))
+
+    def test_moving_reminder_leaves_old_set(self):
+        reminder = self.create_reminder()
+        reminder = SleepReminder.objects.get(pk=reminder.pk)
+        reminder.reminder_time = time(23, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            reminder.save()
+
+        self.assertNotIn(str(reminder.pk).encode(), self.members(22 * 60 + 30))
+        self.assertIn(str(reminder.pk).encode(), self.members(23 * 60))
+
+    def test_delete_removes_reminder(self):
+        reminder = self.create_reminder()
+        reminder_id = reminder.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            reminder.delete()
+
+        self.assertNotIn(str(reminder_id).encode(), self.members(22 * 60 + 30))
+
+    def test_redis_error_does_not_fail_save(self):
+        with mock.patch.object(self.redis, 'pipeline', side_effect=redis.ConnectionError), \
+                self.assertLogs('tracker.cache', 'ERROR'):
+            reminder = self.create_reminder()
+        self.assertTrue(SleepReminder.objects.filter(pk=reminder.pk).exists())
+
+    def test_missing_set_triggers_rebuild(self):
+        first = self.create_reminder()
+        second = self.create_reminder()
+        # Simulate eviction of this minute's set
+        self.redis.delete(tracker_cache.reminder_index_key('bedtime', 22 * 60 + 30))
+
+        due = tracker_cache.due_reminder_ids('bedtime', 22 * 60 + 30)
+        self.assertCountEqual(due, [first.pk, second.pk])
+
+    def test_empty_minute_returns_no_ids(self):
+        self.create_reminder()
+        self.assertEqual(tracker_cache.due_reminder_ids('bedtime', 0), [])
+        # The rebuilt set holds only the placeholder, so it isn't rebuilt again
+        self.assertEqual(self.members(0), {b'0'})
+
+    def test_rebuild_keeps_reminders_indexed_meanwhile(self):
+        reminder = self.create_reminder()
+        key = tracker_cache.reminder_index_key('bedtime', 22 * 60 + 30)
+        self.redis.delete(key)
+        # Indexed by another worker after the rebuild read the database
+        self.redis.sadd(key, 999)
+
+        tracker_cache.rebuild_reminder_set('bedtime', 22 * 60 + 30)
+        self.assertEqual(self.members(22 * 60 + 30), {b'0', b'999', str(reminder.pk).encode()})
+
+    def test_falls_back_to_database_without_redis(self):
+        reminder = self.create_reminder()
+        with mock.patch.object(self.redis, 'smembers', side_effect=redis.ConnectionError), \
+                self.assertLogs('tracker.cache', 'ERROR'):
+            due = tracker_cache.due_reminder_ids('bedtime', 22 * 60 + 30)
+        self.assertEqual(due, [reminder.pk])
+
+    def test_batch_skips_reminder_moved_behind_the_index(self):
+        reminder = self.create_reminder()
+        # queryset.update() bypasses the signals, leaving the set stale
+        SleepReminder.objects.filter(pk=reminder.pk).update(reminder_time=time(23, 0))
+        due = tracker_cache.due_reminder_ids('bedtime', 22 * 60 + 30)
+        self.assertEqual(due, [reminder.pk])
+
+        send_reminder_batch.apply(args=[due, 'bedtime', 22 * 60 + 30])
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class ReminderMinuteOfDayTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper')
+
+    def minute_of_day(self, reminder):
+        return SleepReminder.objects.values_list('reminder_minute_of_day', flat=True).get(pk=reminder.pk)
+
+    def test_bulk_created_reminders_get_their_minute(self):
+        SleepReminder.objects.bulk_create([
+            SleepReminder(user=self.user, reminder_type='bedtime', reminder_time=time(22, 30)),
+            SleepReminder(user=self.user, reminder_type='wake', reminder_time=time(6, 45)),
+        ])
+        self.assertCountEqual(
+            SleepReminder.objects.values_list('reminder_minute_of_day', flat=True),
+            [22 * 60 + 30, 6 * 60 + 45]
+        )
+
+    def test_queryset_update_recomputes_minute(self):
+        reminder = SleepReminder.objects.create(
+            user=self.user, reminder_type='bedtime', reminder_time=time(22, 30)
+        )
+        SleepReminder.objects.filter(pk=reminder.pk).update(reminder_time=time(23, 15))
+        self.assertEqual(self.minute_of_day(reminder), 23 * 60 + 15)
+
+    def test_save_keeps_instance_in_step(self):
+        reminder = SleepReminder.objects.create(
+            user=self.user, reminder_type='bedtime', reminder_time=time(22, 30)
+        )
+        reminder.reminder_time = time(21, 5)
+        reminder.save(update_fields=['reminder_time'])
+
+        self.assertEqual(reminder.reminder_minute_of_day, 21 * 60 + 5)
+        self.assertEqual(self.minute_of_day(reminder), 21 * 60 + 5)
+
+
+class SleepGoalSerializerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper')
+
+    def test_accepts_list_of_weekdays(self):
+        serializer = SleepGoalSerializer(data={
+            'target_bedtime': '22:30', 'target_wake_time': '06:30', 'days_of_week': [0, 2, 4, 4]
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        goal = serializer.save(user=self.user)
+
+        goal.refresh_from_db()
+        self.assertEqual(goal.days_of_week, 0b10101)
+        self.assertEqual(SleepGoalSerializer(goal).data['days_of_week'], [0, 2, 4])
+
+    def test_rejects_weekdays_out_of_range(self):
+        serializer = SleepGoalSerializer(data={
+            'target_bedtime': '22:30', 'target_wake_time': '06:30', 'days_of_week': [7]
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('days_of_week', serializer.errors)
+
+    def test_partial_update_without_days_keeps_them(self):
+        goal = SleepGoal.objects.create(
+            user=self.user, target_bedtime=time(22, 30), target_wake_time=time(6, 30),
+            days_of_week=SleepGoal.days_to_mask([5, 6])
+        )
+        serializer = SleepGoalSerializer(goal, data={'is_active': False}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        goal.refresh_from_db()
+        self.assertEqual(goal.days_of_week, 0b1100000)
+
+
+class SendMessagesTests(TestCase):
+    def test_empty_list_opens_no_connection(self):
+        with mock.patch('tracker.notifications.get_connection') as get_connection:
+            self.assertEqual(EmailNotificationService.send_messages([]), [])
+        get_connection.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SendReminderBatchRetryTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(tracker_cache, '_redis', return_value=FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.reminders = []
+        for i in range(4):
+            user = User.objects.create_user(f'sleeper{i}', f'sleeper{i}@example.com')
+            self.reminders.append(SleepReminder.objects.create(
+                user=user, reminder_type='bedtime', reminder_time=time(22, 30)
+            ))
+        self.reminder_ids = [reminder.pk for reminder in self.reminders]
+
+    @override_settings(EMAIL_BACKEND='tracker.tests.FlakyEmailBackend')
+    def test_disconnect_retries_only_unsent_reminders(self):
+        with mock.patch.object(send_reminder_batch, 'retry', side_effect=Retry()) as retry:
+            send_reminder_batch.apply(args=[self.reminder_ids, 'bedtime', 22 * 60 + 30])
+
+        self.assertEqual(len(mail.outbox), 2)
+        sent = {message.to[0] for message in mail.outbox}
+        self.assertEqual(sent, {'sleeper0@example.com', 'sleeper1@example.com'})
+
+        retry_kwargs = retry.call_args.kwargs
+        self.assertEqual(retry_kwargs['args'], [self.reminder_ids[2:], 'bedtime', 22 * 60 + 30])
+
+        last_sent = dict(SleepReminder.objects.values_list('id', 'last_sent'))
+        self.assertIsNotNone(last_sent[self.reminder_ids[0]])
+        self.assertIsNotNone(last_sent[self.reminder_ids[1]])
+        self.assertIsNone(last_sent[self.reminder_ids[2]])
+        self.assertIsNone(last_sent[self.reminder_ids[3]])
+
+    def test_refused_recipient_is_skipped(self):
+        def refuse_first(messages, original=EmailBackend.send_messages):
+            if messages[0].to == ['sleeper0@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'sleeper0@example.com': (550, b'No such user')})
+            return original(backend, messages)
+
+        backend = EmailBackend()
+        with mock.patch('tracker.notifications.get_connection', return_value=backend), \
+                mock.patch.object(backend, 'send_messages', side_effect=refuse_first), \
+                self.assertLogs('tracker.notifications', 'WARNING'):
+            send_reminder_batch.apply(args=[self.reminder_ids, 'bedtime', 22 * 60 + 30])
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIsNone(SleepReminder.objects.get(pk=self.reminder_ids[0]).last_sent)
+        self.assertIsNotNone(SleepReminder.objects.get(pk=self.reminder_ids[1]).last_sent)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SaveStatisticsTests(TestCase):
+    def setUp(self):
+        self.date = datetime(2025, 1, 1).date()
+        self.early = User.objects.create_user('early')
+        self.late = User.objects.create_user('late')
+        self.log_sleep(self.early, hours=8, quality=4)
+        self.log_sleep(self.early, hours=6, quality=2, day_offset=1)
+        self.log_sleep(self.late, hours=7)
+
+    def log_sleep(self, user, hours, quality=None, day_offset=0):
+        sleep_time = datetime(2025, 1, 1, 1, 0, tzinfo=dt_timezone.utc) + timedelta(days=day_offset)
+        SleepSession.objects.create(
+            user=user,
+            sleep_time=sleep_time,
+            wake_time=sleep_time + timedelta(hours=hours),
+            quality_rating=quality
+        )
+
+    def test_aggregates_per_user(self):
+        saved = _save_statistics(SleepSession.objects.all(), self.date, 'weekly')
+
+        self.assertEqual(saved, 2)
+        early = SleepStatistics.objects.get(user=self.early)
+        self.assertEqual(float(early.total_sleep_hours), 14.0)
+        self.assertEqual(float(early.average_sleep_hours), 7.0)
+        self.assertEqual(float(early.average_quality), 3.0)
+        self.assertEqual(early.sessions_count, 2)
+
+        late = SleepStatistics.objects.get(user=self.late)
+        self.assertEqual(float(late.average_sleep_hours), 7.0)
+        self.assertIsNone(late.average_quality)
+
+    def test_updates_existing_rows_in_place(self):
+        SleepStatistics.objects.create(
+            user=self.early, date=self.date, period_type='weekly',
+            total_sleep_hours=1, average_sleep_hours=1, sessions_count=1
+        )
+        _save_statistics(SleepSession.objects.all(), self.date, 'weekly')
+
+        self.assertEqual(SleepStatistics.objects.count(), 2)
+        early = SleepStatistics.objects.get(user=self.early)
+        self.assertEqual(float(early.total_sleep_hours), 14.0)
+        self.assertEqual(early.sessions_count, 2)
+
+    def test_upserts_in_batches(self):
+        with mock.patch.object(tasks, 'STATISTICS_BATCH_SIZE', 1), \
+                mock.patch.object(tasks, '_upsert_statistics', wraps=tasks._upsert_statistics) as upsert:
+            saved = _save_statistics(SleepSession.objects.all(), self.date, 'weekly')
+
+        self.assertEqual(saved, 2)
+        self.assertEqual(upsert.call_count, 2)
+        self.assertEqual(SleepStatistics.objects.count(), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StatisticsCacheInvalidationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper')
+        self.addCleanup(cache.clear)
+        self.path = '/api/statistics/'
+        self.key = tracker_cache.statistics_cache_key(self.user.pk, self.path)
+
+    def make_statistics(self, **kwargs):
+        return SleepStatistics(user=self.user, date=datetime(2025, 1, 1).date(), period_type='daily', **kwargs)
+
+    def test_saving_statistics_changes_the_key(self):
+        self.make_statistics().save()
+        self.assertNotEqual(tracker_cache.statistics_cache_key(self.user.pk, self.path), self.key)
+
+    def test_bulk_upsert_changes_the_key(self):
+        tasks._upsert_statistics([self.make_statistics(sessions_count=1)])
+        self.assertNotEqual(tracker_cache.statistics_cache_key(self.user.pk, self.path), self.key)
+
+    def test_other_users_keep_their_key(self):
+        other = User.objects.create_user('other')
+        other_key = tracker_cache.statistics_cache_key(other.pk, self.path)
+        self.make_statistics().save()
+        self.assertEqual(tracker_cache.statistics_cache_key(other.pk, self.path), other_key)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SummaryCacheInvalidationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sleeper')
+        self.addCleanup(cache.clear)
+        sleep_time = datetime(2025, 1, 1, 22, 0, tzinfo=dt_timezone.utc)
+        self.session = SleepSession.objects.create(
+            user=self.user,
+            sleep_time=sleep_time,
+            wake_time=sleep_time + timedelta(hours=8)
+        )
+        self.key = tracker_cache.summary_cache_key(self.user.pk)
+        cache.set(self.key, {'sessions_count': 1})
+
+    def test_editing_a_session_drops_the_summary(self):
+        self.session.quality_rating = 4
+        self.session.save()
+        self.assertIsNone(cache.get(self.key))
+
+    def test_deleting_a_session_drops_the_summary(self):
+        self.session.delete()
+        self.assertIsNone(cache.get(self.key))
+
+    def test_calendar_sync_save_keeps_the_summary(self):
+        self.session.calendar_event_id = 'event'
+        self.session.synced_to_calendar = True
+        self.session.save(update_fields=['calendar_event_id', 'synced_to_calendar'])
+        self.assertIsNotNone(cache.get(self.key))
@@ -6,8 +6,11 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.db.models import Avg, Count, Sum
 from django.utils import timezone
 from datetime import timedelta
+from functools import cached_property
 from .models import UserProfile, SleepSession, SleepGoal, SleepReminder, SleepStatistics
 from .serializers import (
     UserProfileSerializer, SleepSessionSerializer,
@@ -16,6 +19,24 @@ from .serializers import (
 )
 from .tasks import sync_sleep_to_calendar
 from .google_calendar import GoogleCalendarService
+from .cache import (
+    STATISTICS_CACHE_TIMEOUT, SUMMARY_CACHE_TIMEOUT,
+    statistics_cache_key, summary_cache_key
+)
+
+
+class ProfileCachedMixin:
+    """
+    Load the requesting user's profile at most once per request
+    """
+
+    @cached_property
+    def _profile(self):
+        return UserProfile.objects.filter(user=self.request.user).only('google_calendar_enabled').first()
+
+    @property
+    def _calendar_enabled(self):
+        return self._profile is not None and self._profile.google_calendar_enabled
 
 
 class UserProfileViewSet(viewsets.ModelViewSet):
@@ -53,7 +74,7 @@ class UserProfileViewSet(viewsets.ModelViewSet):
             )
 
 
-class SleepSessionViewSet(viewsets.ModelViewSet):
+class SleepSessionViewSet(ProfileCachedMixin, viewsets.ModelViewSet):
     """
     ViewSet for SleepSession
     """
@@ -83,7 +104,7 @@ class SleepSessionViewSet(viewsets.ModelViewSet):
         sleep_session = serializer.save(user=self.request.user)
 
         # Check if Google Calendar sync is enabled
-        if hasattr(self.request.user, 'profile') and self.request.user.profile.google_calendar_enabled:
+        if self._calendar_enabled:
             #Trigger async task to sync to calendar
             sync_sleep_to_calendar.delay(sleep_session.id)
 
@@ -92,14 +113,14 @@ class SleepSessionViewSet(viewsets.ModelViewSet):
         sleep_session = serializer.save()
 
         # Check if Google Calendar sync is enabled
-        if hasattr(self.request.user, 'profile') and self.request.user.profile.google_calendar_enabled:
+        if self._calendar_enabled:
             sync_sleep_to_calendar.delay(sleep_session.id)
 
     @action(detail=False, methods=['get'])
     def recent(self, request):
         """Get recent sleep sessions (last 7 days)"""
         seven_days_ago = timezone.now() - timedelta(days=7)
-        sessions = self.get_queryset().filter(sleep_time_gte=seven_days_ago)
+        sessions = self.get_queryset().filter(sleep_time__gte=seven_days_ago)
         serializer = self.get_serializer(sessions, many=True)
         return Response(serializer.data)
 
@@ -107,7 +128,7 @@ class SleepSessionViewSet(viewsets.ModelViewSet):
     def today(self, request):
         """Get today's sleep session"""
         today = timezone.now().date()
-        sessions = self.get_queryset().filter(sleep_time_date=today)
+        sessions = self.get_queryset().filter(sleep_time__date=today)
         serializer = self.get_serializer(sessions, many=True)
         return Response(serializer.data)
 
@@ -116,7 +137,7 @@ class SleepSessionViewSet(viewsets.ModelViewSet):
         """Manually sync a sleep session to Google Calendar"""
         sleep_session = self.get_object()
 
-        if not hasattr(request.user, 'profile') or not request.user.profile.google_calendar_enabled:
+        if not self._calendar_enabled:
             return Response(
                 {'error': 'Google Calendar not connected'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -187,39 +208,57 @@ class SleepStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """List statistics, served from cache until the user's stats change"""
+        cache_key = statistics_cache_key(request.user.pk, request.get_full_path())
+        data = cache.get(cache_key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(cache_key, data, STATISTICS_CACHE_TIMEOUT)
+        return Response(data)
+
     @action(detail=False, methods=['get'])
     def summary(self, request):
         """Get overall statistics summary"""
-        # Get last 30 days of sessions
+        # Dashboards poll this; session saves and deletes drop the cached copy
+        cache_key = summary_cache_key(request.user.pk)
+        data = cache.get(cache_key)
+        if data is None:
+            data = self._compute_summary(request.user)
+            cache.set(cache_key, data, SUMMARY_CACHE_TIMEOUT)
+        return Response(data)
+
+    def _compute_summary(self, user):
+        """Aggregate the last 30 days of sessions in a single query"""
         thirty_days_ago = timezone.now() - timedelta(days=30)
-        sessions = SleepSession.objects.filter(
-            user=request.user,
+        totals = SleepSession.objects.filter(
+            user=user,
             sleep_time__gte=thirty_days_ago
+        ).aggregate(
+            total_sessions=Count('id'),
+            total_hours=Sum('duration_hours'),
+            avg_quality=Avg('quality_rating')
         )
 
-        if not sessions.exists():
-            return Response({
+        if not totals['total_sessions']:
+            return {
                 'message': 'No sleep data available',
                 'sessions_count': 0
-            })
+            }
 
-        total_hours = sum(s.duration_hours or 0 for s in sessions)
-        avg_hours = total_hours / sessions.count()
-        
-        quality_sessions = sessions.filter(quality_rating__isnull=False)
-        avg_quality = None
-        if quality_sessions.exists():
-            avg_quality = sum(s.quality_rating for s in quality_sessions) / quality_sessions.count()
+        total_hours = totals['total_hours'] or 0
+        avg_hours = total_hours / totals['total_sessions']
+        avg_quality = totals['avg_quality']
 
-        return Response({
+        return {
             'period': '30_days',
-            'total_sessions': sessions.count(),
+            'total_sessions': totals['total_sessions'],
             'total_sleep_hours': round(total_hours, 2),
             'average_sleep_hours': round(avg_hours, 2),
             'average_quality': round(avg_quality, 2) if avg_quality else None,
             'start_date': thirty_days_ago.date(),
             'end_date': timezone.now().date()
-        })
+        }
 
 
 # Template views